@@ -1,6 +1,8 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 from unittest import TestCase, mock
 
+import copy
+
 from tlab.google import credentials
 
 
@@ -16,8 +18,10 @@ class TestCredentials_new(TestCase):
         client_ids = [f"clientId{i}" for i in range(3)]
         for client_id in client_ids:
             from_client_config_mock.reset_mock()
-            client_config = credentials.CLIENT_CONFIG.copy()
-            client_config["installed"]["client_id"] = client_id
+            client_config = {
+                **credentials.CLIENT_CONFIG,
+                "installed": {**credentials.CLIENT_CONFIG["installed"], "client_id": client_id}
+            }
             with self.subTest(client_id=client_id):
                 creds = credentials.Credentials.new(client_id=client_id)
                 self.assertEqual(creds._credentials, flow_mock.run_local_server.return_value)
@@ -29,13 +33,20 @@ class TestCredentials_new(TestCase):
         client_secrets = [f"clientSecret{i}" for i in range(3)]
         for client_secret in client_secrets:
             from_client_config_mock.reset_mock()
-            client_config = credentials.CLIENT_CONFIG.copy()
-            client_config["installed"]["client_secret"] = client_secret
+            client_config = {
+                **credentials.CLIENT_CONFIG,
+                "installed": {**credentials.CLIENT_CONFIG["installed"], "client_secret": client_secret}
+            }
             with self.subTest(client_secret=client_secret):
                 creds = credentials.Credentials.new(client_secret=client_secret)
                 self.assertEqual(creds._credentials, flow_mock.run_local_server.return_value)
                 from_client_config_mock.assert_called_once_with(client_config, credentials.SCOPES)
 
+    def test_client_config_unchanged(self, from_client_config_mock: mock.Mock) -> None:
+        client_config = copy.deepcopy(credentials.CLIENT_CONFIG)
+        credentials.Credentials.new(client_id="clientId", client_secret="clientSecret")
+        self.assertDictEqual(credentials.CLIENT_CONFIG, client_config)
+
     def test_run_local_server(self, from_client_config_mock: mock.Mock) -> None:
         flow_mock = from_client_config_mock.return_value
         assert isinstance(flow_mock, mock.Mock)
@@ -2,7 +2,7 @@
 from unittest import TestCase, mock
 
 import base64
-from email.mime import text
+from email.mime import application, multipart, text
 import typing as t
 
 from tlab.google import gmail, credentials
@@ -33,8 +33,8 @@ class TestGmailAPI_search_email(TestCase):
     api: gmail.GmailAPI
 
     def setUp(self) -> None:
-        self.api = gmail.GmailAPI(Credentials())
-        self.api._service = mock.Mock()
+        with mock.patch("googleapiclient.discovery.build"):
+            self.api = gmail.GmailAPI(Credentials())
 
     def _test(
         self,
@@ -166,8 +166,8 @@ class TestGmailAPI_get_email(TestCase):
     api: gmail.GmailAPI
 
     def setUp(self) -> None:
-        self.api = gmail.GmailAPI(Credentials())
-        self.api._service = mock.Mock()
+        with mock.patch("googleapiclient.discovery.build"):
+            self.api = gmail.GmailAPI(Credentials())
 
     def _test(
         self,
@@ -217,13 +217,282 @@ class TestGmailAPI_get_email(TestCase):
                     format=format
                 )
 
+    def test_resource_cached(self) -> None:
+        self.api._service.reset_mock()
+        self.api.get_email("0")
+        self.api.get_email("1")
+        self.api._service.users.assert_not_called()
+
+
+def get_request_mock(userId: str, id: str, format: str) -> mock.Mock:
+    """A fake of users.messages.get which returns a request for the message with the ID."""
+    request = mock.Mock()
+    request.execute.return_value = {"id": id, "format": format}
+    return request
+
+
+class BatchHttpRequestMock:
+    """A fake of googleapiclient.http.BatchHttpRequest which executes the requests in order."""
+
+    def __init__(self, callback: t.Callable[[str, t.Any, Exception | None], None]) -> None:
+        self.callback = callback
+        self.requests: list[tuple[str, t.Any]] = []
+
+    def add(self, request: t.Any, request_id: str) -> None:
+        self.requests.append((request_id, request))
+
+    def execute(self) -> None:
+        for request_id, request in self.requests:
+            self.callback(request_id, request.execute(), None)
+
+
+@mock.patch("google_auth_httplib2.AuthorizedHttp")
+class TestGmailAPI_get_emails(TestCase):
+    api: gmail.GmailAPI
+
+    def setUp(self) -> None:
+        with mock.patch("googleapiclient.discovery.build"):
+            self.api = gmail.GmailAPI(Credentials())
+        self.get = self.api._service \
+            .users.return_value \
+            .messages.return_value \
+            .get
+        self.get.side_effect = get_request_mock
+
+    def _test(
+        self,
+        authorized_http_mock: mock.Mock,
+        ids: list[str],
+        format: t.Literal["minimal", "full", "raw", "metadata"],
+        max_workers: int
+    ) -> None:
+        self.get.reset_mock()
+        authorized_http_mock.reset_mock()
+        requests: list[mock.Mock] = []
+
+        def get(userId: str, id: str, format: str) -> mock.Mock:
+            request = get_request_mock(userId, id, format)
+            requests.append(request)
+            return request
+
+        self.get.side_effect = get
+        result = self.api.get_emails(ids, format=format, max_workers=max_workers)
+        self.assertListEqual(result, [{"id": id, "format": format} for id in ids])
+        self.assertEqual(self.get.call_count, len(ids))
+        for id in ids:
+            self.get.assert_any_call(userId=self.api.user_id, id=id, format=format)
+        # Each request must be executed on an authorized HTTP object of the worker thread
+        for request in requests:
+            request.execute.assert_called_once_with(http=authorized_http_mock.return_value)
+        if ids:
+            self.assertGreaterEqual(authorized_http_mock.call_count, 1)
+        self.assertLessEqual(authorized_http_mock.call_count, max_workers)
+
+    def test_ids(self, authorized_http_mock: mock.Mock) -> None:
+        ids_list = [[f"{j:016x}" for j in range(i)] for i in (0, 1, 30)]
+        for ids in ids_list:
+            with self.subTest(num_ids=len(ids)):
+                self._test(authorized_http_mock, ids, "full", 10)
+
+    def test_format(self, authorized_http_mock: mock.Mock) -> None:
+        formats: list[t.Literal["minimal", "full", "raw", "metadata"]] = [
+            "minimal", "full", "raw", "metadata"
+        ]
+        for format in formats:
+            with self.subTest(format=format):
+                self._test(authorized_http_mock, ["0", "1", "2"], format, 10)
+
+    def test_max_workers(self, authorized_http_mock: mock.Mock) -> None:
+        for max_workers in (1, 2, 10):
+            with self.subTest(max_workers=max_workers):
+                self._test(authorized_http_mock, [str(i) for i in range(20)], "full", max_workers)
+
+    def test_exception(self, authorized_http_mock: mock.Mock) -> None:
+        request = mock.Mock()
+        request.execute.side_effect = RuntimeError("error")
+        self.get.side_effect = None
+        self.get.return_value = request
+        with self.assertRaises(RuntimeError):
+            self.api.get_emails(["0"])
+        request.execute.assert_called_once_with(http=authorized_http_mock.return_value)
+
+
+class TestGmailAPI_search_and_fetch_email(TestCase):
+    api: gmail.GmailAPI
+
+    def setUp(self) -> None:
+        with mock.patch("googleapiclient.discovery.build"):
+            self.api = gmail.GmailAPI(Credentials())
+        self.batches: list[BatchHttpRequestMock] = []
+
+        def new_batch_http_request(callback: t.Callable[[str, t.Any, Exception | None], None]) -> BatchHttpRequestMock:
+            batch = BatchHttpRequestMock(callback)
+            self.batches.append(batch)
+            return batch
+
+        self.api._service.new_batch_http_request.side_effect = new_batch_http_request
+        self.messages = self.api._service \
+            .users.return_value \
+            .messages.return_value
+        self.messages.get.side_effect = get_request_mock
+
+    def _test(
+        self,
+        num_messages: int,
+        format: t.Literal["minimal", "full", "raw", "metadata"]
+    ) -> None:
+        self.batches.clear()
+        ids = [i.to_bytes(2, "little").hex() for i in range(num_messages)]
+        next_page_token = "pagetoken"
+        result_size_estimate = num_messages
+        self.messages.list.return_value.execute.return_value = {
+            "messages": [{"id": id, "threadId": id} for id in ids],
+            "nextPageToken": next_page_token,
+            "resultSizeEstimate": result_size_estimate
+        }
+        result = self.api.search_and_fetch_email("subject:(Subject)", format=format)
+        self.assertListEqual(result[0], [{"id": id, "format": format} for id in ids])
+        self.assertEqual(result[1], next_page_token)
+        self.assertEqual(result[2], result_size_estimate)
+        self.assertEqual(len(self.batches), -(-num_messages // gmail.MAX_BATCH_SIZE))
+        for batch in self.batches:
+            self.assertLessEqual(len(batch.requests), gmail.MAX_BATCH_SIZE)
+
+    def test_num_messages(self) -> None:
+        format: t.Literal["minimal", "full", "raw", "metadata"] = "full"
+        for num_messages in [0, 1, gmail.MAX_BATCH_SIZE, gmail.MAX_BATCH_SIZE + 1]:
+            with self.subTest(num_messages=num_messages):
+                self._test(num_messages, format)
+
+    def test_format(self) -> None:
+        formats: list[t.Literal["minimal", "full", "raw", "metadata"]] = [
+            "minimal", "full", "raw", "metadata"
+        ]
+        for format in formats:
+            with self.subTest(format=format):
+                self._test(3, format)
+
+    def test_exception(self) -> None:
+        self.messages.list.return_value.execute.return_value = {
+            "messages": [{"id": "0", "threadId": "0"}],
+        }
+
+        def new_batch_http_request(callback: t.Callable[[str, t.Any, Exception | None], None]) -> mock.Mock:
+            batch = mock.Mock()
+            batch.execute.side_effect = lambda: callback("0", None, RuntimeError("error"))
+            return batch
+
+        self.api._service.new_batch_http_request.side_effect = new_batch_http_request
+        with self.assertRaises(RuntimeError):
+            self.api.search_and_fetch_email("subject:(Subject)")
+
+
+@mock.patch("google_auth_httplib2.AuthorizedHttp")
+class TestGmailAPI_iter_search_email(TestCase):
+    api: gmail.GmailAPI
+
+    def setUp(self) -> None:
+        with mock.patch("googleapiclient.discovery.build"):
+            self.api = gmail.GmailAPI(Credentials())
+        self.api._service.new_batch_http_request.side_effect = BatchHttpRequestMock
+        self.messages = self.api._service \
+            .users.return_value \
+            .messages.return_value
+
+        self.messages.get.side_effect = get_request_mock
+
+    def _test(
+        self,
+        authorized_http_mock: mock.Mock,
+        pages: list[list[str]],
+        format: t.Literal["minimal", "full", "raw", "metadata"]
+    ) -> None:
+        self.messages.list.reset_mock()
+        page_tokens = [""] + [f"pagetoken{i}" for i in range(1, len(pages))]
+        list_requests: list[mock.Mock] = []
+        get_requests: list[mock.Mock] = []
+
+        def get(userId: str, id: str, format: str) -> mock.Mock:
+            request = get_request_mock(userId, id, format)
+            get_requests.append(request)
+            return request
+
+        def list_messages(
+            userId: str,
+            q: str,
+            maxResults: int,
+            pageToken: str,
+            labelIds: list[str],
+            includeSpamTrash: bool
+        ) -> mock.Mock:
+            i = page_tokens.index(pageToken)
+            response: dict[str, t.Any] = {"messages": [{"id": id, "threadId": id} for id in pages[i]]}
+            if i + 1 < len(pages):
+                response["nextPageToken"] = page_tokens[i + 1]
+            request = mock.Mock()
+            request.execute.return_value = response
+            list_requests.append(request)
+            return request
+
+        self.messages.list.side_effect = list_messages
+        self.messages.get.side_effect = get
+        query = "subject:(Subject)"
+        result = [message for message in self.api.iter_search_email(query, page_size=3, format=format)]
+        self.assertListEqual(result, [{"id": id, "format": format} for page in pages for id in page])
+        self.assertEqual(self.messages.list.call_count, len(pages))
+        for page_token in page_tokens:
+            self.messages.list.assert_any_call(
+                userId=self.api.user_id,
+                q=query,
+                maxResults=3,
+                pageToken=page_token,
+                labelIds=[],
+                includeSpamTrash=False
+            )
+        # The pages are listed on the HTTP object of the background thread
+        for request in list_requests:
+            request.execute.assert_called_once_with(http=authorized_http_mock.return_value)
+        # while the messages are fetched by batch requests on the HTTP object of the service
+        for request in get_requests:
+            request.execute.assert_called_once_with()
+
+    def test_pages(self, authorized_http_mock: mock.Mock) -> None:
+        pages_list: list[list[list[str]]] = [
+            [[]],
+            [["0", "1"]],
+            [["0", "1", "2"], ["3", "4", "5"], ["6"]],
+        ]
+        for pages in pages_list:
+            with self.subTest(pages=pages):
+                self._test(authorized_http_mock, pages, "metadata")
+
+    def test_format(self, authorized_http_mock: mock.Mock) -> None:
+        formats: list[t.Literal["minimal", "full", "raw", "metadata"]] = [
+            "minimal", "full", "raw", "metadata"
+        ]
+        for format in formats:
+            with self.subTest(format=format):
+                self._test(authorized_http_mock, [["0", "1", "2"], ["3"]], format)
+
+    def test_stop_after_first_message(self, authorized_http_mock: mock.Mock) -> None:
+        self.messages.list.return_value.execute.return_value = {
+            "messages": [{"id": id, "threadId": id} for id in ["0", "1", "2"]],
+            "nextPageToken": "pagetoken1"
+        }
+        iterator = self.api.iter_search_email("subject:(Subject)")
+        for message in iterator:
+            self.assertDictEqual(message, {"id": "0", "format": "metadata"})
+            break
+        iterator.close()
+        self.messages.list.assert_called_once()
+
 
 class TestGmailAPI_send_email(TestCase):
     api: gmail.GmailAPI
 
     def setUp(self) -> None:
-        self.api = gmail.GmailAPI(Credentials())
-        self.api._service = mock.Mock()
+        with mock.patch("googleapiclient.discovery.build"):
+            self.api = gmail.GmailAPI(Credentials())
 
     def test_message(self) -> None:
         messages = [f"This is a mail test({i})." for i in range(3)]
@@ -242,13 +511,28 @@ class TestGmailAPI_send_email(TestCase):
                 )
                 send.return_value.execute.assert_called_once_with()
 
+    def test_multipart(self) -> None:
+        msg = multipart.MIMEMultipart()
+        msg["Subject"] = "Test"
+        msg.attach(text.MIMEText("From here on, this is a mail test."))
+        msg.attach(application.MIMEApplication(bytes(range(256)) * 16))
+        self.api.send_email(msg)
+        send = self.api._service \
+            .users.return_value \
+            .messages.return_value \
+            .send
+        send.assert_called_once_with(
+            userId=self.api.user_id,
+            body={"raw": base64.urlsafe_b64encode(msg.as_bytes()).decode()}
+        )
+
 
 class TestGmailAPI_get_signature(TestCase):
     api: gmail.GmailAPI
 
     def setUp(self) -> None:
-        self.api = gmail.GmailAPI(Credentials())
-        self.api._service = mock.Mock()
+        with mock.patch("googleapiclient.discovery.build"):
+            self.api = gmail.GmailAPI(Credentials())
         self.sendas_list = [
             {
                 "sendAsEmail": f"foo{i}@example.com",
@@ -291,3 +575,14 @@ class TestGmailAPI_get_signature(TestCase):
         for address in addresses:
             with self.subTest(address=address):
                 self._test(address=address)
+
+    def test_no_default(self) -> None:
+        self.sendas_list.remove(self.default_sendas)
+        list = self.api._service \
+            .users.return_value \
+            .settings.return_value \
+            .sendAs.return_value \
+            .list
+        list.return_value.execute.return_value = {"sendAs": self.sendas_list}
+        with self.assertRaises(ValueError):
+            self.api.get_signature()
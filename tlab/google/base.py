@@ -1,17 +1,29 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 import typing as t
 
-from googleapiclient import discovery
+import google_auth_httplib2
+from googleapiclient import discovery, http
 
 from tlab.google import credentials, abstract
 
 
 class BaseAPI(abstract.AbstractAPI):
     _service: t.Any
+    _credentials: credentials.Credentials
 
     def __init__(self, credentials: credentials.Credentials, version: str) -> None:
+        self._credentials = credentials
         self._service = discovery.build(
             serviceName=self.service_name,
             version=version,
             credentials=credentials._credentials
         )
+
+    def _new_http(self) -> google_auth_httplib2.AuthorizedHttp:
+        """
+        Create a new authorized HTTP object.
+
+        The HTTP object of the service is not thread-safe,
+        so each thread must execute requests with its own HTTP object.
+        """
+        return google_auth_httplib2.AuthorizedHttp(self._credentials._credentials, http=http.build_http())
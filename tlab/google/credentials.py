@@ -1,5 +1,6 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 from __future__ import annotations
+import copy
 import os
 
 from google.auth.transport import requests
@@ -54,7 +55,7 @@ class Credentials:
         tlab.google.credentials.Credentials
             The new credentials.
         """
-        client_config = CLIENT_CONFIG.copy()
+        client_config = copy.deepcopy(CLIENT_CONFIG)
         if client_id:
             client_config["installed"]["client_id"] = client_id
         if client_secret:
@@ -1,16 +1,23 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 import base64
+from concurrent import futures
+from email import generator
 from email.mime import base as mimebase
+import io
+import threading
 import typing as t
 
 from tlab.google import base, credentials
 
 
 Message = dict[str, t.Any]
+MAX_BATCH_SIZE = 50  # Gmail API tends to rate-limit batch requests with more calls than this
 
 
 class GmailAPI(base.BaseAPI):
     _user_id: str
+    _messages: t.Any
+    _sendas: t.Any
 
     def __init__(
         self,
@@ -19,6 +26,8 @@ class GmailAPI(base.BaseAPI):
     ) -> None:
         super().__init__(credentials, version)
         self._user_id = "me"
+        self._messages = self._service.users().messages()
+        self._sendas = self._service.users().settings().sendAs()
 
     @property
     def service_name(self) -> str:
@@ -72,7 +81,7 @@ class GmailAPI(base.BaseAPI):
         --------
         https://developers.google.com/gmail/api/reference/rest/v1/users.messages/list
         """
-        result = self._service.users().messages().list(
+        result = self._messages.list(
             userId=self.user_id,
             q=query,
             maxResults=max_results,
@@ -80,10 +89,7 @@ class GmailAPI(base.BaseAPI):
             labelIds=label_ids or [],
             includeSpamTrash=include_spam_trash
         ).execute()
-        messages = [
-            {str(key): message[key] for key in message}
-            for message in result.get("messages", [])
-        ]
+        messages: list[Message] = list(result.get("messages", []))
         next_page_token = str(result.get("nextPageToken", ""))
         result_size_estimate = int(result.get("resultSizeEstimate", 0))
         return messages, next_page_token, result_size_estimate
@@ -110,12 +116,200 @@ class GmailAPI(base.BaseAPI):
         tlab.google.gmail.Message
             See also https://developers.google.com/gmail/api/reference/rest/v1/users.messages#Message for Message.
         """
-        result = self._service.users().messages().get(
+        result: Message = self._messages.get(
             userId=self.user_id,
             id=id,
             format=format
         ).execute()
-        return {str(key): result[key] for key in result}
+        return result
+
+    def get_emails(
+        self,
+        ids: list[str],
+        *,
+        format: t.Literal["minimal", "full", "raw", "metadata"] = "full",
+        max_workers: int = 10
+    ) -> list[Message]:
+        """
+        Get emails in the mailbox of Gmail concurrently.
+
+        Each email is requested by its own HTTP request in a thread pool.
+
+        Parameters
+        ----------
+        ids : list[str]
+            The IDs of the messages to retrieve.
+        format : Literal["minimal", "full", "raw", "metadata"]
+            The format to return the messages in.
+            See also https://developers.google.com/gmail/api/reference/rest/v1/Format.
+        max_workers : int
+            The maximum number of threads to send requests.
+
+        Returns
+        -------
+        list[tlab.google.gmail.Message]
+            The messages in the same order as `ids`.
+            See also https://developers.google.com/gmail/api/reference/rest/v1/users.messages#Message for Message.
+        """
+        local = threading.local()
+
+        def get_email(id: str) -> Message:
+            if not hasattr(local, "http"):
+                local.http = self._new_http()
+            result: Message = self._messages.get(
+                userId=self.user_id,
+                id=id,
+                format=format
+            ).execute(http=local.http)
+            return result
+
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(get_email, ids))
+
+    def search_and_fetch_email(
+        self,
+        query: str,
+        *,
+        max_results: int = 100,
+        page_token: str | None = None,
+        label_ids: list[str] | None = None,
+        include_spam_trash: bool = False,
+        format: t.Literal["minimal", "full", "raw", "metadata"] = "full"
+    ) -> tuple[list[Message], str, int]:
+        """
+        Search the user's mailbox on Gmail and get the found emails.
+
+        The emails are fetched by batch requests instead of calling `get_email` for each message.
+        A batch request contains at most 50 calls, because larger batches are likely to be rate-limited.
+        If fetching any of the emails fails, the error is raised and no emails are returned.
+
+        Parameters
+        ----------
+        query : str
+            The same query format as the Gmail search box.
+        max_results : int
+            Maximum number of messages to return.
+        page_token : str | None
+            The page token to retrieve a specific page of results in the list.
+        label_ids : list[str] | None
+            The label IDs of messages to return.
+        include_spam_trash : bool
+            If true, messages from SPAM and TRASH are included in the results.
+        format : Literal["minimal", "full", "raw", "metadata"]
+            The format to return the messages in.
+            See also https://developers.google.com/gmail/api/reference/rest/v1/Format.
+
+        Returns
+        -------
+        messages : list[tlab.google.gmail.Message]
+            The list of messages in the same order as `search_email`.
+            See also https://developers.google.com/gmail/api/reference/rest/v1/users.messages#Message for Message.
+        next_page_token : str
+            The token to retrieve the next page.
+        result_size_estimate : int
+            The estimated total number of results.
+
+        See Also
+        --------
+        https://developers.google.com/gmail/api/guides/batch
+        """
+        messages, next_page_token, result_size_estimate = self.search_email(
+            query,
+            max_results=max_results,
+            page_token=page_token,
+            label_ids=label_ids,
+            include_spam_trash=include_spam_trash
+        )
+        ids = [str(message["id"]) for message in messages]
+        return self._batch_get_email(ids, format=format), next_page_token, result_size_estimate
+
+    def iter_search_email(
+        self,
+        query: str,
+        *,
+        page_size: int = 100,
+        label_ids: list[str] | None = None,
+        include_spam_trash: bool = False,
+        format: t.Literal["minimal", "full", "raw", "metadata"] = "metadata"
+    ) -> t.Generator[Message, None, None]:
+        """
+        Iterate over all the emails found in the user's mailbox on Gmail.
+
+        The pages of the search results are retrieved automatically.
+        The emails of each page are fetched by batch requests.
+        The next page is retrieved in the background once the second email of the current page is requested,
+        so stopping after the first email of a page sends no request for the next page.
+
+        Parameters
+        ----------
+        query : str
+            The same query format as the Gmail search box.
+        page_size : int
+            Maximum number of messages to retrieve in a page.
+        label_ids : list[str] | None
+            The label IDs of messages to return.
+        include_spam_trash : bool
+            If true, messages from SPAM and TRASH are included in the results.
+        format : Literal["minimal", "full", "raw", "metadata"]
+            The format to return the messages in.
+            See also https://developers.google.com/gmail/api/reference/rest/v1/Format.
+
+        Yields
+        ------
+        tlab.google.gmail.Message
+            See also https://developers.google.com/gmail/api/reference/rest/v1/users.messages#Message for Message.
+        """
+        def list_ids(page_token: str, http: t.Any) -> tuple[list[str], str]:
+            result = self._messages.list(
+                userId=self.user_id,
+                q=query,
+                maxResults=page_size,
+                pageToken=page_token,
+                labelIds=label_ids or [],
+                includeSpamTrash=include_spam_trash
+            ).execute(http=http)
+            ids = [str(message["id"]) for message in result.get("messages", [])]
+            return ids, str(result.get("nextPageToken", ""))
+
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            # The HTTP object of the service is used by batch requests in this thread
+            http = self._new_http()
+            future: futures.Future[tuple[list[str], str]] | None = executor.submit(list_ids, "", http)
+            while future is not None:
+                ids, next_page_token = future.result()
+                messages = iter(self._batch_get_email(ids, format=format))
+                message = next(messages, None)
+                if message is not None:
+                    yield message
+                future = executor.submit(list_ids, next_page_token, http) if next_page_token else None
+                yield from messages
+
+    def _batch_get_email(
+        self,
+        ids: list[str],
+        *,
+        format: t.Literal["minimal", "full", "raw", "metadata"] = "full"
+    ) -> list[Message]:
+        results: list[Message] = [{} for _ in ids]
+
+        def callback(request_id: str, response: Message, exception: Exception | None) -> None:
+            if exception is not None:
+                raise exception
+            results[int(request_id)] = response
+
+        for start in range(0, len(ids), MAX_BATCH_SIZE):
+            batch = self._service.new_batch_http_request(callback=callback)
+            for i, id in enumerate(ids[start:start + MAX_BATCH_SIZE], start):
+                batch.add(
+                    self._messages.get(
+                        userId=self.user_id,
+                        id=id,
+                        format=format
+                    ),
+                    request_id=str(i)
+                )
+            batch.execute()
+        return results
 
     def send_email(
         self,
@@ -129,8 +323,12 @@ class GmailAPI(base.BaseAPI):
         message : email.mime.base.MIMEBase
             The message to send.
         """
-        raw_body = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        self._service.users().messages().send(
+        with io.BytesIO() as buffer:
+            # Equivalent to message.as_bytes() without copying the rendered message
+            generator.BytesGenerator(buffer, mangle_from_=False, policy=message.policy).flatten(message)
+            with buffer.getbuffer() as view:
+                raw_body = base64.urlsafe_b64encode(view).decode("ascii")
+        self._messages.send(
             userId=self.user_id,
             body={"raw": raw_body}
         ).execute()
@@ -159,17 +357,17 @@ class GmailAPI(base.BaseAPI):
         ValueError
             If a signature for the address is not found.
         """
-        response = self._service.users().settings().sendAs().list(
+        response = self._sendas.list(
             userId=self.user_id,
         ).execute()
-        addr_to_sendas = {
-            sendas["sendAsEmail"]: sendas for sendas in response.get("sendAs", [])
-        }
+        sendas_list = response.get("sendAs", [])
         if address is None:
             # Get the default send-as alias
-            sendas = [sendas for sendas in addr_to_sendas.values() if sendas.get("isDefault", False)].pop()
+            sendas = next((sendas for sendas in sendas_list if sendas.get("isDefault", False)), None)
+            if sendas is None:
+                raise ValueError("A signature for the default send-as alias not found")
         else:
-            if address not in addr_to_sendas.keys():
+            sendas = next((sendas for sendas in sendas_list if sendas["sendAsEmail"] == address), None)
+            if sendas is None:
                 raise ValueError(f"A signature for {address} not found")
-            sendas = addr_to_sendas[address]
         return str(sendas.get("signature", ""))